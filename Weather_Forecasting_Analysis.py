@@ -1,8 +1,24 @@
+import glob
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import prophet
 from prophet import Prophet
+from prophet.serialize import model_from_json, model_to_json
+
+logger = logging.getLogger(__name__)
 
 # =====================================================
 # PAGE CONFIG
@@ -98,30 +114,267 @@ def load_geo():
         on="iso3",
         how="left"
     )
+    geo["city_name"] = geo["city_name"].astype("category")
 
     return geo
 
 
 @st.cache_data
 def load_weather():
-    df = pd.read_parquet(
+    dataset = ds.dataset(
         r"C:\data_science_project\daily_weather.parquet",
-        columns=["date", "avg_temp_c", "city_name"]
+        format="parquet"
+    )
+
+    table = dataset.to_table(
+        columns=["date", "avg_temp_c", "city_name"],
+        filter=(
+            pc.field("date").is_valid()
+            & pc.field("avg_temp_c").is_valid()
+            & pc.field("city_name").is_valid()
+        )
+    )
+    table = table.set_column(
+        table.schema.get_field_index("city_name"),
+        "city_name",
+        pc.dictionary_encode(table["city_name"])
     )
 
-    df.columns = df.columns.str.lower().str.strip()
+    df = table.to_pandas()
 
     df["date"] = pd.to_datetime(df["date"], errors="coerce")
-    df["avg_temp_c"] = pd.to_numeric(df["avg_temp_c"], errors="coerce")
-    df["city_name"] = df["city_name"].astype(str)
+    df["avg_temp_c"] = pd.to_numeric(df["avg_temp_c"], errors="coerce", downcast="float")
 
     df = df.dropna()
 
+    df["year"] = df["date"].dt.year.astype("int16")
+
     return df
 
 
+def to_unit(celsius, unit):
+    if unit == "Fahrenheit (°F)":
+        temperature = np.multiply(celsius, np.asarray(1.8, celsius.dtype))
+        return np.add(temperature, np.asarray(32, celsius.dtype), out=temperature)
+    return celsius
+
+
+def moving_mean(values, window):
+    result = np.full(values.size, np.nan)
+    if values.size >= window:
+        csum = np.cumsum(np.r_[0.0, values])
+        result[window - 1:] = (csum[window:] - csum[:-window]) / window
+    return result
+
+
+def lttb_indices(x, y, n_out):
+    n = x.size
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    idx = np.empty(n_out, dtype=int)
+    idx[0], idx[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < edges.size else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+
+    return idx
+
+
+@st.cache_resource
+def city_sorted_parquet():
+    source = os.stat(r"C:\data_science_project\daily_weather.parquet")
+    path = (
+        r"C:\data_science_project\daily_weather_by_city"
+        f"_{source.st_size}_{source.st_mtime_ns}.parquet"
+    )
+
+    if not os.path.exists(path):
+        df = load_weather()[["date", "avg_temp_c", "city_name"]]
+        table = pa.Table.from_pandas(
+            df.astype({"city_name": str}),
+            preserve_index=False
+        )
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(
+            table.sort_by([("city_name", "ascending"), ("date", "ascending")]),
+            tmp_path,
+            row_group_size=200_000
+        )
+        os.replace(tmp_path, path)
+
+    stale = glob.glob(r"C:\data_science_project\daily_weather_by_city_*.parquet*")
+    for stale_path in stale:
+        if stale_path != path:
+            os.remove(stale_path)
+
+    return path
+
+
+def read_city(path, city):
+    table = ds.dataset(path, format="parquet").to_table(
+        columns=["date", "avg_temp_c"],
+        filter=pc.field("city_name") == city
+    )
+
+    return table.to_pandas()
+
+
+@st.cache_data
+def load_city(city):
+    return read_city(city_sorted_parquet(), city)
+
+
+@st.cache_data(show_spinner=False)
+def daily_trend_indices(city):
+    df = load_city(city)
+
+    return lttb_indices(
+        df["date"].to_numpy().astype("datetime64[s]").astype(np.int64).astype(np.float64),
+        df["avg_temp_c"].to_numpy().astype(np.float64),
+        2000
+    )
+
+
+@st.cache_data
+def city_year_sums():
+    city_year = load_weather().groupby(
+        ["year", "city_name"],
+        observed=True
+    )["avg_temp_c"].agg(["sum", "count"]).reset_index()
+
+    city_year = city_year.merge(
+        load_geo()[["city_name", "iso3"]],
+        on="city_name",
+        how="left"
+    )
+    city_year["iso3"] = city_year["iso3"].astype("category")
+
+    return city_year
+
+
+@st.cache_data
+def country_avg_c():
+    country_avg = city_year_sums().groupby("iso3", observed=True)[["sum", "count"]].sum()
+    country_avg["avg_temp_c"] = country_avg["sum"] / country_avg["count"]
+
+    return country_avg[["avg_temp_c"]].reset_index()
+
+
+@st.cache_data
+def year_avg_c():
+    year_avg = city_year_sums().groupby(["year", "iso3"], observed=True)[["sum", "count"]].sum()
+    year_avg["avg_temp_c"] = year_avg["sum"] / year_avg["count"]
+
+    return year_avg[["avg_temp_c"]].reset_index()
+
+
+def monthly_means(dates, temperature):
+    months = dates.astype("datetime64[M]")
+
+    month_starts = np.r_[0, np.flatnonzero(months[1:] != months[:-1]) + 1]
+    month_counts = np.diff(np.r_[month_starts, temperature.size])
+
+    return pd.DataFrame({
+        "year_month": months[month_starts].astype("datetime64[ns]"),
+        "temperature": np.add.reduceat(temperature, month_starts) / month_counts
+    })
+
+
+def prophet_input(monthly):
+    prophet_df = monthly[["year_month", "temperature"]].rename(
+        columns={"year_month": "ds", "temperature": "y"}
+    )
+
+    data_key = hashlib.blake2b(
+        pd.util.hash_pandas_object(prophet_df, index=False).values.tobytes()
+    ).hexdigest()
+
+    return prophet_df, data_key
+
+
+def load_or_fit_prophet(city, unit, data_key, prophet_df):
+    model_key = hashlib.blake2b(
+        f"{city}|{unit}|{data_key}|{prophet.__version__}".encode()
+    ).hexdigest()
+    path = os.path.join(r"C:\data_science_project\prophet_models", f"{model_key}.json")
+
+    if os.path.exists(path):
+        with open(path) as f:
+            return model_from_json(f.read())
+
+    model = Prophet(
+        uncertainty_samples=0,
+        daily_seasonality=False,
+        weekly_seasonality=False
+    )
+    model.fit(prophet_df)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(model_to_json(model))
+    os.replace(tmp_path, path)
+
+    return model
+
+
+@st.cache_resource(show_spinner=False)
+def fit_prophet(city, unit, data_key, _prophet_df, _pending=None):
+    if _pending is not None:
+        wait([_pending])
+    return load_or_fit_prophet(city, unit, data_key, _prophet_df)
+
+
+def warm_prophet(path, city, unit):
+    df = read_city(path, city)
+    temperature = to_unit(df["avg_temp_c"].to_numpy(), unit)
+
+    prophet_df, data_key = prophet_input(monthly_means(df["date"].to_numpy(), temperature))
+    load_or_fit_prophet(city, unit, data_key, prophet_df)
+
+
+def log_warmup_failure(city, future):
+    if future.exception() is not None:
+        logger.error("Prophet warm-up failed for %s", city, exc_info=future.exception())
+
+
+@st.cache_resource(show_spinner=False)
+def start_prophet_warmup(unit, top_k=8):
+    path = city_sorted_parquet()
+    city_year = city_year_sums().drop_duplicates(["year", "city_name"])
+    city_rows = city_year.groupby("city_name", observed=True)["count"].sum()
+
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+    futures = {}
+    for city in city_rows.nlargest(top_k).index:
+        future = executor.submit(warm_prophet, path, city, unit)
+        future.add_done_callback(partial(log_warmup_failure, city))
+        futures[(city, unit)] = future
+    executor.shutdown(wait=False)
+
+    return futures
+
+
+@st.cache_data(show_spinner=False)
+def predict_prophet(city, unit, data_key, _model):
+    future = _model.make_future_dataframe(periods=12, freq="MS")
+    return _model.predict(future)
+
+
 geo_df = load_geo()
-weather = load_weather()
 
 # =====================================================
 # SIDEBAR
@@ -141,13 +394,10 @@ unit = st.sidebar.radio("Temperature Unit", ["Celsius (°C)", "Fahrenheit (°F)"
 # FILTER DATA
 # =====================================================
 
-filtered = weather[weather["city_name"] == selected_city].copy()
-filtered = filtered.sort_values("date")
+filtered = load_city(selected_city)
 
-if unit == "Fahrenheit (°F)":
-    filtered["temperature"] = filtered["avg_temp_c"] * 9/5 + 32
-else:
-    filtered["temperature"] = filtered["avg_temp_c"]
+filtered["temperature"] = to_unit(filtered["avg_temp_c"].to_numpy(), unit)
+temperature = filtered["temperature"].to_numpy()
 
 # =====================================================
 # KPI SECTION
@@ -155,9 +405,9 @@ else:
 
 col1, col2, col3 = st.columns(3)
 
-col1.metric("🌡 Average", round(filtered["temperature"].mean(), 2))
-col2.metric("🔥 Max", round(filtered["temperature"].max(), 2))
-col3.metric("❄ Min", round(filtered["temperature"].min(), 2))
+col1.metric("🌡 Average", round(float(filtered["temperature"].mean()), 2))
+col2.metric("🔥 Max", round(float(filtered["temperature"].max()), 2))
+col3.metric("❄ Min", round(float(filtered["temperature"].min()), 2))
 
 st.markdown("---")
 
@@ -168,11 +418,12 @@ st.markdown(f"**Selected Continent:** {selected_continent} | **Selected City:**
 # =====================================================
 
 fig_daily = px.line(
-    filtered,
+    filtered.iloc[daily_trend_indices(selected_city)],
     x="date",
     y="temperature",
     template="plotly_white",
-    title="Daily Temperature Trend"
+    title="Daily Temperature Trend",
+    render_mode="webgl"
 )
 
 fig_daily.update_layout(
@@ -196,18 +447,9 @@ This suggests long-term climate variation patterns in the selected region.
 
 st.subheader("🌍 Global Temperature Choropleth")
 
-map_df = weather.merge(
-    geo_df[["city_name", "iso3", "continent"]],
-    on="city_name",
-    how="left"
-)
-
-country_avg = map_df.groupby("iso3")["avg_temp_c"].mean().reset_index()
+country_avg = country_avg_c()
 
-if unit == "Fahrenheit (°F)":
-    country_avg["temperature"] = country_avg["avg_temp_c"] * 9/5 + 32
-else:
-    country_avg["temperature"] = country_avg["avg_temp_c"]
+country_avg["temperature"] = to_unit(country_avg["avg_temp_c"].to_numpy(), unit)
 
 fig_choropleth = px.choropleth(
     country_avg,
@@ -231,57 +473,55 @@ showing how climate varies geographically worldwide.
 """)
 
 # =====================================================
-# ANIMATED MAP
+# YEARLY MAP
 # =====================================================
 
-st.subheader("🎬 Animated Climate Change Over Years")
-
-weather["year"] = weather["date"].dt.year
-
-year_avg = weather.merge(
-    geo_df[["city_name", "iso3"]],
-    on="city_name",
-    how="left"
-)
+st.subheader("🗓️ Climate by Year")
 
-year_avg = year_avg.groupby(["year", "iso3"])["avg_temp_c"].mean().reset_index()
+year_avg = year_avg_c()
 
-fig_anim = px.choropleth(
-    year_avg,
-    locations="iso3",
-    color="avg_temp_c",
-    animation_frame="year",
-    color_continuous_scale="Turbo",
-    title="Global Climate Change Over Years"
-)
+if year_avg.empty:
+    st.warning("No yearly temperature data is available.")
+else:
+    years = sorted(year_avg["year"].unique().tolist())
+    selected_year = st.select_slider("Year", options=years, value=years[-1])
+
+    fig_year = px.choropleth(
+        year_avg[year_avg["year"] == selected_year],
+        locations="iso3",
+        color="avg_temp_c",
+        color_continuous_scale="Turbo",
+        range_color=(year_avg["avg_temp_c"].min(), year_avg["avg_temp_c"].max()),
+        title=f"Average Temperature by Country in {selected_year}"
+    )
 
-fig_anim.update_layout(
-    template="plotly_white",
-    paper_bgcolor='rgba(0,0,0,0)'
-)
+    fig_year.update_layout(
+        template="plotly_white",
+        paper_bgcolor='rgba(0,0,0,0)'
+    )
 
-st.plotly_chart(fig_anim, use_container_width=True)
+    st.plotly_chart(fig_year, use_container_width=True)
 
-st.info("""
+    st.info("""
 📌 **Conclusion:**  
-The animation demonstrates long-term global warming trends,  
+Stepping through the years demonstrates long-term global warming trends,  
 indicating gradual temperature rise across multiple regions over decades.
 """)
 
+warmup_fits = start_prophet_warmup("Celsius (°C)")
+
 # =====================================================
 # ANOMALY DETECTION
 # =====================================================
 
 st.subheader("🚨 Trend Anomaly Detection")
 
-filtered["year_month"] = filtered["date"].dt.to_period("M")
-monthly = filtered.groupby("year_month")["temperature"].mean().reset_index()
-monthly["year_month"] = monthly["year_month"].dt.to_timestamp()
+monthly = monthly_means(filtered["date"].to_numpy(), temperature)
 
-monthly["rolling"] = monthly["temperature"].rolling(12).mean()
+monthly["rolling"] = moving_mean(monthly["temperature"].to_numpy(), 12)
 monthly["deviation"] = monthly["temperature"] - monthly["rolling"]
 
-threshold = monthly["deviation"].std() * 2
+threshold = np.nanstd(monthly["deviation"].to_numpy(), ddof=1) * 2
 anomalies = monthly[np.abs(monthly["deviation"]) > threshold]
 
 fig_anomaly = px.line(
@@ -320,15 +560,16 @@ which may indicate extreme weather events or climate shifts.
 
 st.subheader("📈 AI Forecasting (Prophet)")
 
-prophet_df = filtered[["date", "temperature"]].rename(
-    columns={"date": "ds", "temperature": "y"}
-)
-
-model = Prophet()
-model.fit(prophet_df)
+prophet_df, prophet_key = prophet_input(monthly)
 
-future = model.make_future_dataframe(periods=365)
-forecast = model.predict(future)
+model = fit_prophet(
+    selected_city,
+    unit,
+    prophet_key,
+    prophet_df,
+    warmup_fits.get((selected_city, unit))
+)
+forecast = predict_prophet(selected_city, unit, prophet_key, model)
 
 fig_forecast = px.line(
     forecast,
@@ -356,16 +597,22 @@ This predictive analysis helps anticipate possible climate shifts over the next
 
 st.subheader("🔥❄ Extreme Events Tracker")
 
-heat_threshold = np.percentile(filtered["temperature"], 95)
-cold_threshold = np.percentile(filtered["temperature"], 5)
+rank = (temperature.size - 1) * np.array([0.05, 0.95])
+rank_lo = np.floor(rank).astype(int)
+rank_hi = np.minimum(rank_lo + 1, temperature.size - 1)
+
+ranked = np.partition(temperature, np.unique(np.r_[rank_lo, rank_hi]))
+cold_threshold, heat_threshold = (
+    ranked[rank_lo] + (rank - rank_lo) * (ranked[rank_hi] - ranked[rank_lo])
+)
 
-heatwave_days = filtered[filtered["temperature"] > heat_threshold]
-coldwave_days = filtered[filtered["temperature"] < cold_threshold]
+heatwave_days = int(np.count_nonzero(temperature > heat_threshold))
+coldwave_days = int(np.count_nonzero(temperature < cold_threshold))
 
 col1, col2 = st.columns(2)
 
-col1.metric("🔥 Heatwave Days (Above 95th Percentile)", len(heatwave_days))
-col2.metric("❄ Cold Wave Days (Below 5th Percentile)", len(coldwave_days))
+col1.metric("🔥 Heatwave Days (Above 95th Percentile)", heatwave_days)
+col2.metric("❄ Cold Wave Days (Below 5th Percentile)", coldwave_days)
 
 st.info(f"""
 📌 **Extreme Events Insight:**  